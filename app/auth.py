@@ -1,63 +1,106 @@
 import os
 import sqlite3
+import threading
+import time
 from datetime import datetime, timedelta
 from typing import Optional, Dict
 
+from cachetools import TTLCache
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
+import jwt
 from passlib.context import CryptContext
 
 DB_PATH = os.getenv('USERS_DB', os.path.join('data', 'users.db'))
 SECRET_KEY = os.getenv('SECRET_KEY', 'change-this-secret')
 ALGORITHM = 'HS256'
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+TOKEN_CACHE_TTL_SECONDS = int(os.getenv('TOKEN_CACHE_TTL_SECONDS', '300'))
+TOKEN_CACHE_MAXSIZE = int(os.getenv('TOKEN_CACHE_MAXSIZE', '10000'))
+
+# bcrypt work factor for new hashes. Hashes at any other cost still verify, but are flagged by
+# needs_update (min/max rounds) and rehashed at this cost on the user's next successful login.
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '10'))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
+# verified against for unknown usernames so failed logins take the same time either way; this
+# only holds for accounts whose hash is at BCRYPT_ROUNDS, which authenticate_user ensures by
+# migrating legacy-cost hashes on login
+_DUMMY_HASH = pwd_context.hash('dummy-password')
+
+# token -> (user dict, exp timestamp) for tokens that already passed verification
+_token_cache = TTLCache(maxsize=TOKEN_CACHE_MAXSIZE, ttl=TOKEN_CACHE_TTL_SECONDS)
+_token_cache_lock = threading.Lock()
+
+
+# A single shared autocommit connection is opened (and the schema created) by init_db() at
+# startup, or on first use; sqlite3 connections are not safe for concurrent use, so every
+# access goes through _conn_lock.
+_conn = None
+_conn_lock = threading.Lock()
+
 
 def _get_conn():
-    os.makedirs(os.path.dirname(DB_PATH) or '.', exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("""CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        hashed_password TEXT NOT NULL
-    )""")
-    conn.commit()
-    return conn
+    # caller must hold _conn_lock
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(DB_PATH) or '.', exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            hashed_password TEXT NOT NULL
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
+        _conn = conn
+    return _conn
+
+
+def init_db():
+    with _conn_lock:
+        _get_conn()
 
 
 def get_user_by_username(username: str) -> Optional[Dict]:
-    conn = _get_conn()
-    cur = conn.execute("SELECT id, username, hashed_password FROM users WHERE username = ?", (username,))
-    row = cur.fetchone()
-    conn.close()
+    with _conn_lock:
+        cur = _get_conn().execute("SELECT id, username, hashed_password FROM users WHERE username = ?", (username,))
+        row = cur.fetchone()
     if not row:
         return None
-    return {"id": row[0], "username": row[1], "hashed_password": row[2]}
+    return dict(row)
 
 
 def get_user_by_id(user_id: int) -> Optional[Dict]:
-    conn = _get_conn()
-    cur = conn.execute("SELECT id, username, hashed_password FROM users WHERE id = ?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
+    with _conn_lock:
+        cur = _get_conn().execute("SELECT id, username, hashed_password FROM users WHERE id = ?", (user_id,))
+        row = cur.fetchone()
     if not row:
         return None
-    return {"id": row[0], "username": row[1], "hashed_password": row[2]}
+    return dict(row)
 
 
 def create_user(username: str, password: str) -> Dict:
     if get_user_by_username(username) is not None:
         raise HTTPException(status_code=400, detail="Username already exists")
     hashed = pwd_context.hash(password)
-    conn = _get_conn()
-    cur = conn.execute("INSERT INTO users (username, hashed_password) VALUES (?, ?)", (username, hashed))
-    conn.commit()
-    user_id = cur.lastrowid
-    conn.close()
+    try:
+        with _conn_lock:
+            cur = _get_conn().execute("INSERT INTO users (username, hashed_password) VALUES (?, ?)", (username, hashed))
+            user_id = cur.lastrowid
+    except sqlite3.IntegrityError:
+        # lost a race with a concurrent signup for the same username
+        raise HTTPException(status_code=400, detail="Username already exists")
     return {"id": user_id, "username": username}
 
 
@@ -68,9 +111,15 @@ def verify_password(plain_password, hashed_password) -> bool:
 def authenticate_user(username: str, password: str) -> Optional[Dict]:
     user = get_user_by_username(username)
     if not user:
+        verify_password(password, _DUMMY_HASH)
         return None
-    if not verify_password(password, user['hashed_password']):
+    ok, new_hash = pwd_context.verify_and_update(password, user['hashed_password'])
+    if not ok:
         return None
+    if new_hash is not None:
+        # hash was created at a different cost (e.g. before BCRYPT_ROUNDS existed); migrate it
+        with _conn_lock:
+            _get_conn().execute("UPDATE users SET hashed_password = ? WHERE id = ?", (new_hash, user['id']))
     return {"id": user['id'], "username": user['username']}
 
 
@@ -86,6 +135,12 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 
 def get_current_user(token: str = Depends(oauth2_scheme)):
+    # serve repeat tokens from the cache, skipping the HMAC check and the users lookup
+    with _token_cache_lock:
+        cached = _token_cache.get(token)
+    if cached is not None and cached[1] > time.time():
+        return dict(cached[0])
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -96,9 +151,14 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
         user_id: int = int(payload.get("sub")) if payload.get("sub") else None
         if user_id is None:
             raise credentials_exception
-    except JWTError:
+    except jwt.PyJWTError:
         raise credentials_exception
     user = get_user_by_id(user_id)
     if user is None:
         raise credentials_exception
-    return {"id": user['id'], "username": user['username']}
+    current = {"id": user['id'], "username": user['username']}
+    exp = payload.get("exp")
+    if exp is not None:
+        with _token_cache_lock:
+            _token_cache[token] = (current, float(exp))
+    return dict(current)
@@ -1,24 +1,57 @@
-import pickle
+import msgpack
 import redis
-from typing import Any
+from typing import Any, Dict, List, Optional
 
 
 class RedisCache:
-    def __init__(self, url: str = "redis://localhost:6379/0", namespace: str = "mr"):
-        self.client = redis.Redis.from_url(url, decode_responses=False)
+    DELETE_BATCH_SIZE = 500
+
+    def __init__(self, url: str = "redis://localhost:6379/0", namespace: str = "mr", max_connections: int = 50):
+        # bounded pool of kept-alive connections; callers wait for a free one instead of erroring
+        pool = redis.BlockingConnectionPool.from_url(
+            url,
+            max_connections=max_connections,
+            timeout=5,
+            socket_keepalive=True,
+            health_check_interval=30,
+            decode_responses=False,
+        )
+        self.client = redis.Redis(connection_pool=pool)
         self.namespace = namespace
 
     def _pref(self, key: str) -> str:
         return f"{self.namespace}:{key}"
 
     def get(self, key: str) -> Any:
-        v = self.client.get(self._pref(key))
+        return self._decode(self.client.get(self._pref(key)))
+
+    @staticmethod
+    def _decode(v: Optional[bytes]) -> Any:
         if v is None:
             return None
-        return pickle.loads(v)
+        try:
+            return msgpack.unpackb(v, raw=False)
+        except Exception:
+            # undecodable entry (e.g. written by an older pickle-based build); treat as a miss
+            return None
 
     def set(self, key: str, value: Any, ex: int = 3600):
-        self.client.set(self._pref(key), pickle.dumps(value), ex=ex)
+        self.client.set(self._pref(key), msgpack.packb(value, use_bin_type=True), ex=ex)
+
+    def get_many(self, keys: List[str]) -> List[Any]:
+        """Fetch several keys with one MGET; missing or undecodable entries come back as None."""
+        if not keys:
+            return []
+        return [self._decode(v) for v in self.client.mget([self._pref(k) for k in keys])]
+
+    def set_many(self, items: Dict[str, Any], ex: int = 3600):
+        """Write several keys in one pipelined round-trip."""
+        if not items:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for k, v in items.items():
+            pipe.set(self._pref(k), msgpack.packb(v, use_bin_type=True), ex=ex)
+        pipe.execute()
 
     def delete(self, key: str):
         self.client.delete(self._pref(key))
@@ -26,9 +59,19 @@ class RedisCache:
     def delete_pattern(self, pattern: str):
         # pattern is without namespace, we prefix it
         full_pattern = self._pref(pattern)
-        # Use scan_iter to avoid blocking Redis
-        for k in self.client.scan_iter(match=full_pattern):
-            try:
-                self.client.delete(k)
-            except Exception:
-                pass
+        # Use scan_iter to avoid blocking Redis; remove keys in batches with UNLINK
+        # (one round-trip per batch, memory freed asynchronously on the server)
+        batch = []
+        for k in self.client.scan_iter(match=full_pattern, count=1000):
+            batch.append(k)
+            if len(batch) >= self.DELETE_BATCH_SIZE:
+                self._unlink(batch)
+                batch = []
+        if batch:
+            self._unlink(batch)
+
+    def _unlink(self, keys):
+        try:
+            self.client.unlink(*keys)
+        except Exception:
+            pass
@@ -1,4 +1,6 @@
 import os
+import random
+import time
 import redis
 from typing import List, Optional, Any, Union
 
@@ -22,6 +24,14 @@ def _parse_redis_url(url: str) -> dict:
     return {'host': host, 'port': port, 'db': db, 'password': password}
 
 
+def _backoff_delays(initial: float = 0.01, maximum: float = 0.5):
+    """Yield exponentially growing retry delays with jitter, capped at `maximum`."""
+    delay = initial
+    while True:
+        yield delay + random.random() * delay
+        delay = min(delay * 2, maximum)
+
+
 class RedLockManager:
     """Wrapper that uses redlock-py if available, else falls back to single-node redis lock.
 
@@ -46,7 +56,8 @@ class RedLockManager:
         self._clients = []
         for u in urls:
             cfg = _parse_redis_url(u)
-            client = redis.Redis(host=cfg['host'], port=cfg['port'], db=cfg['db'], password=cfg['password'])
+            client = redis.Redis(host=cfg['host'], port=cfg['port'], db=cfg['db'], password=cfg['password'],
+                                 max_connections=10, socket_keepalive=True, health_check_interval=30)
             self._clients.append(client)
 
         # Validate quorum if requested (RedLock requires multiple independent masters; recommend >=3)
@@ -76,24 +87,31 @@ class RedLockManager:
                 if not lock:
                     LOCK_ACQUIRE_FAILED_TOTAL.inc()
                 return lock
-            end = None
-            import time
-            if timeout:
-                end = time.time() + timeout
-            while True:
+            end = time.time() + timeout if timeout else None
+            for delay in _backoff_delays():
                 lock = self._dlm.lock(resource, ttl)
                 if lock:
                     return lock
                 if end and time.time() > end:
                     LOCK_ACQUIRE_FAILED_TOTAL.inc()
                     return None
-                time.sleep(0.1)
+                time.sleep(max(0, min(delay, end - time.time())) if end else delay)
 
         # fallback: use first redis client with redis-py Lock
         if self._clients:
             client = self._clients[0]
             lock = client.lock(resource, timeout=ttl/1000 if ttl else None)
-            have = lock.acquire(blocking=block, blocking_timeout=timeout if block else None)
+            have = lock.acquire(blocking=False)
+            if not have and block:
+                # same backoff as above rather than redis-py's fixed-interval polling
+                end = time.time() + timeout if timeout else None
+                for delay in _backoff_delays():
+                    if end and time.time() > end:
+                        break
+                    time.sleep(max(0, min(delay, end - time.time())) if end else delay)
+                    have = lock.acquire(blocking=False)
+                    if have:
+                        break
             if not have:
                 LOCK_ACQUIRE_FAILED_TOTAL.inc()
             return lock if have else None
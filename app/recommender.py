@@ -1,15 +1,15 @@
 import os
-import joblib
 import logging
+import tempfile
 import numpy as np
-import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.preprocessing import normalize
+from typing import Any, NamedTuple
 from prometheus_client import Summary, Counter
 
 log = logging.getLogger(__name__)
 
+# pandas, scipy, sklearn and joblib are imported inside the methods that use them so that
+# importing this module (and booting the API) does not pay their import cost up front.
+
 # Metrics
 MODEL_SAVE_METRIC = Summary('retrain_duration_seconds', 'Time spent retraining model')
 RECOMMEND_COUNTER = Counter('recommend_requests_total', 'Number of recommend calls')
@@ -17,48 +17,150 @@ RECOMMEND_LATENCY = Summary('recommend_latency_seconds', 'Latency for recommend
 RETRAIN_SUCCESS = Counter('retrain_success_total', 'Number of successful retrains')
 RETRAIN_FAILURE = Counter('retrain_failure_total', 'Number of failed retrains')
 
+# the insertion buffer in _combine_top_n costs O(items * n); past this n the numpy
+# argpartition path is faster
+_TOPN_KERNEL_MAX_N = 64
+
+# numba-compiled _combine_top_n; compiled on first use (numba is optional and slow to import),
+# False when numba is unavailable so the numpy path is used instead
+_topn_kernel = None
+
+
+def _combine_top_n(item_sim, content_sim, n):
+    # single pass: add the two score vectors and keep the n best in a small sorted buffer
+    k = min(n, item_sim.size)
+    top_idx = np.empty(max(k, 0), np.int64)
+    if k <= 0:
+        return top_idx
+    top_val = np.empty(k, np.float64)
+    filled = 0
+    for i in range(item_sim.size):
+        v = item_sim[i] + content_sim[i]
+        if filled < k:
+            j = filled
+            filled += 1
+        elif v > top_val[k - 1]:
+            j = k - 1
+        else:
+            continue
+        while j > 0 and top_val[j - 1] < v:
+            top_val[j] = top_val[j - 1]
+            top_idx[j] = top_idx[j - 1]
+            j -= 1
+        top_val[j] = v
+        top_idx[j] = i
+    return top_idx
+
+
+def _get_topn_kernel():
+    global _topn_kernel
+    if _topn_kernel is None:
+        try:
+            from numba import njit
+            _topn_kernel = njit(cache=True, fastmath=True, nogil=True)(_combine_top_n)
+        except Exception:
+            log.info('numba not available; using numpy top-N selection')
+            _topn_kernel = False
+    return _topn_kernel or None
+
+
+class _Model(NamedTuple):
+    # everything recommend reads, built together and published with a single assignment so a
+    # concurrent retrain can never pair indices from one model with matrices from another
+    user_item: Any
+    item_profiles: Any
+    item_user_norm: Any
+    item_profiles_norm: Any
+    user_index: list
+    item_index: list
+    user_id_to_idx: dict
+    item_id_to_idx: dict
+    movies_df: Any
+    version: str
+
 
 class HybridRecommender:
     def __init__(self, model_path: str = './models/hybrid_model.joblib', cache=None):
         self.model_path = model_path
         self.cache = cache
-        self.user_item = None
-        self.item_profiles = None
-        self.user_index = None
-        self.item_index = None
-        self.model_version = None
-        self.movies_df = None
+        self._model = None
         log.info('HybridRecommender initialized; model_path=%s', self.model_path)
 
+    @property
+    def ready(self) -> bool:
+        # set once the first load/train has completed; requests before that get a 503
+        return self._model is not None
+
+    @property
+    def model_version(self):
+        model = self._model
+        return model.version if model is not None else None
+
     def load_or_train(self):
         if os.path.exists(self.model_path):
             self._load()
         else:
             self.train_and_save()
-
-        # ensure model_version is set after load/train
-        self.model_version = self._compute_model_version()
         log.info('Model loaded/trained; version=%s', self.model_version)
 
+    def _publish(self, model: _Model):
+        # shared tail of every load/train path. Warm the kernel first so the first request on
+        # the new model doesn't pay JIT latency; a successful (re)load makes the recommender
+        # servable, even if an earlier load failed
+        self._warm_topn_kernel()
+        self._model = model
+
     def _load(self):
-        data = joblib.load(self.model_path)
-        self.user_item = data['user_item']
-        self.item_profiles = data['item_profiles']
-        self.user_index = data['user_index']
-        self.item_index = data['item_index']
+        import joblib
+        import pandas as pd
+        import scipy.sparse as sp
+
+        # memory-map the array buffers (including those inside the sparse matrices) instead of
+        # reading them into private memory: loads are near-instant and worker processes
+        # share one page-cache copy. The arrays are read-only, which recommend never violates.
+        data = joblib.load(self.model_path, mmap_mode='r')
+        # older payloads stored dense float64 arrays; both conversions are no-ops for current payloads
+        user_item = sp.csr_matrix(data['user_item'], dtype=np.float32)
+        item_profiles = sp.csr_matrix(data['item_profiles'], dtype=np.float32)
+        user_index = data['user_index']
+        item_index = data['item_index']
+        # id -> row/column lookups; rebuilt for payloads saved before they were persisted
+        user_id_to_idx = data.get('user_id_to_idx') or {u: i for i, u in enumerate(user_index)}
+        item_id_to_idx = data.get('item_id_to_idx') or {m: i for i, m in enumerate(item_index)}
         # movies metadata optional
-        self.movies_df = data.get('movies') if isinstance(data.get('movies'), pd.DataFrame) else None
-        if self.movies_df is None and os.path.exists(os.path.join('data', 'movies.csv')):
+        movies_df = data.get('movies') if isinstance(data.get('movies'), pd.DataFrame) else None
+        if movies_df is None and os.path.exists(os.path.join('data', 'movies.csv')):
             try:
-                self.movies_df = pd.read_csv(os.path.join('data', 'movies.csv')).set_index('movieId')
+                movies_df = pd.read_csv(os.path.join('data', 'movies.csv')).set_index('movieId')
             except Exception:
-                self.movies_df = None
+                movies_df = None
 
-        self.model_version = self._compute_model_version()
+        if 'item_user_norm' in data and 'item_profiles_norm' in data:
+            item_user_norm, item_profiles_norm = data['item_user_norm'], data['item_profiles_norm']
+        else:
+            item_user_norm, item_profiles_norm = self._normalise(user_item, item_profiles)
+
+        self._publish(_Model(
+            user_item=user_item,
+            item_profiles=item_profiles,
+            item_user_norm=item_user_norm,
+            item_profiles_norm=item_profiles_norm,
+            user_index=user_index,
+            item_index=item_index,
+            user_id_to_idx=user_id_to_idx,
+            item_id_to_idx=item_id_to_idx,
+            movies_df=self._clean_movies(movies_df) if movies_df is not None else None,
+            version=self._compute_model_version(),
+        ))
         log.info('Loaded model from %s (version=%s)', self.model_path, self.model_version)
 
     @MODEL_SAVE_METRIC.time()
     def train_and_save(self):
+        import joblib
+        import pandas as pd
+        import scipy.sparse as sp
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
         # Sample data loader: expects `data/movies.csv` and `data/ratings.csv` in workspace
         movies_path = os.path.join('data', 'movies.csv')
         ratings_path = os.path.join('data', 'ratings.csv')
@@ -80,39 +182,95 @@ class HybridRecommender:
         movies = pd.read_csv(movies_path)
         ratings = pd.read_csv(ratings_path)
 
-        # Build user-item matrix
-        pivot = ratings.pivot_table(index='userId', columns='movieId', values='rating', fill_value=0)
-        self.user_index = list(pivot.index)
-        self.item_index = list(pivot.columns)
-        self.user_item = pivot.values
+        # Everything below is built into locals and only published once complete, so requests
+        # served during training keep using the previous model.
+        # Build sparse user-item matrix (ratings are far too sparse for a dense pivot)
+        users = pd.Categorical(ratings['userId'])
+        items = pd.Categorical(ratings['movieId'])
+        user_index = list(users.categories)
+        item_index = list(items.categories)
+        user_id_to_idx = {u: i for i, u in enumerate(user_index)}
+        item_id_to_idx = {m: i for i, m in enumerate(item_index)}
+        user_item = sp.csr_matrix(
+            (ratings['rating'].values, (users.codes, items.codes)),
+            shape=(len(user_index), len(item_index)),
+            dtype=np.float32,
+        )
 
         # Item profiles via TF-IDF on genres + title
-        features = (movies.set_index('movieId').reindex(self.item_index).fillna('')
+        features = (movies.set_index('movieId').reindex(item_index).fillna('')
                     .assign(text=lambda df: df['title'].fillna('') + ' ' + df['genres'].fillna(''))['text'])
-        tf = TfidfVectorizer(max_features=5000)
-        self.item_profiles = tf.fit_transform(features.values).toarray()
+        tf = TfidfVectorizer(max_features=5000, dtype=np.float32)
+        item_profiles = tf.fit_transform(features.values).tocsr()
+        item_user_norm, item_profiles_norm = self._normalise(user_item, item_profiles)
 
         # Save (include movies metadata to allow API to return titles/genres)
         os.makedirs(os.path.dirname(self.model_path) or '.', exist_ok=True)
         payload = {
-            'user_item': self.user_item,
-            'item_profiles': self.item_profiles,
-            'user_index': self.user_index,
-            'item_index': self.item_index,
+            'user_item': user_item,
+            'item_profiles': item_profiles,
+            # persisted so loads can memory-map them rather than recompute them per process
+            'item_user_norm': item_user_norm,
+            'item_profiles_norm': item_profiles_norm,
+            'user_index': user_index,
+            'item_index': item_index,
+            'user_id_to_idx': user_id_to_idx,
+            'item_id_to_idx': item_id_to_idx,
             'movies': movies.set_index('movieId')
         }
+
+        def build_model():
+            return _Model(
+                user_item=user_item,
+                item_profiles=item_profiles,
+                item_user_norm=item_user_norm,
+                item_profiles_norm=item_profiles_norm,
+                user_index=user_index,
+                item_index=item_index,
+                user_id_to_idx=user_id_to_idx,
+                item_id_to_idx=item_id_to_idx,
+                movies_df=self._clean_movies(movies.set_index('movieId')),
+                version=self._compute_model_version(),
+            )
+
+        # write to a unique temp file and swap it in: truncating the live file would pull the pages
+        # out from under processes that still have the previous model memory-mapped, and a shared
+        # temp name would let concurrent retrains interleave their writes
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.model_path) or '.', suffix='.joblib')
+        os.close(fd)
         try:
-            joblib.dump(payload, self.model_path)
-            # set in-memory metadata too
-            self.movies_df = movies.set_index('movieId')
-            # update model version after saving
-            self.model_version = self._compute_model_version()
+            joblib.dump(payload, tmp_path)
+            os.chmod(tmp_path, 0o644)  # mkstemp creates 0600
+            os.replace(tmp_path, self.model_path)
+            # version is computed from the file just written
+            self._publish(build_model())
             log.info('Trained and saved model to %s (version=%s)', self.model_path, self.model_version)
             return True
         except Exception as e:
             log.exception('Failed to save model: %s', e)
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            # with nothing loaded yet, serve the unsaved model rather than nothing; otherwise
+            # keep the previous (saved) model
+            if self._model is None:
+                self._publish(build_model())
             return False
 
+    @staticmethod
+    def _clean_movies(movies_df):
+        # keep only the columns served by recommend, as plain strings with unique movieId keys
+        movies_df = movies_df[~movies_df.index.duplicated()].reindex(columns=['title', 'genres'])
+        return movies_df.fillna('').astype(str)
+
+    @staticmethod
+    def _normalise(user_item, item_profiles):
+        from sklearn.preprocessing import normalize
+
+        # L2-normalise item vectors once so per-request cosine scoring is plain matrix-vector products
+        return normalize(user_item.T.tocsr(), axis=1), normalize(item_profiles, axis=1)
+
     def _compute_model_version(self) -> str:
         try:
             if os.path.exists(self.model_path):
@@ -144,11 +302,64 @@ class HybridRecommender:
             RETRAIN_FAILURE.inc()
             return False
 
+    @staticmethod
+    def _cache_key(model: _Model, user_id: int, n: int) -> str:
+        # include model version in cache key so keys automatically invalidate when model changes
+        return f"rec:v{model.version}:u{user_id}:n{n}"
+
+    def _warm_topn_kernel(self):
+        # compile (or load from numba's on-disk cache) for the float32 score vectors used at
+        # request time, so the first recommend doesn't pay JIT latency
+        global _topn_kernel
+        kernel = _get_topn_kernel()
+        if kernel is not None:
+            dummy = np.zeros(2, dtype=np.float32)
+            try:
+                kernel(dummy, dummy, 1)
+            except Exception:
+                # njit() is lazy, so a broken/mismatched numba only fails here, at first compile
+                log.exception('numba top-N kernel failed to compile; using numpy top-N selection')
+                _topn_kernel = False
+
+    @staticmethod
+    def _top_n(model: _Model, item_sim, content_sim, n: int):
+        # scaling the combined vector doesn't change its ranking, so rank the raw sum
+        kernel = _get_topn_kernel() if n <= _TOPN_KERNEL_MAX_N else None
+        if kernel is not None:
+            top_idx = kernel(item_sim, content_sim, n)
+        else:
+            scores = item_sim + content_sim
+            k = max(0, min(n, scores.size))
+            top_idx = np.argpartition(-scores, k)[:k] if k < scores.size else np.arange(scores.size)
+            top_idx = top_idx[np.argsort(-scores[top_idx])]
+        return [int(model.item_index[i]) for i in top_idx]
+
+    @staticmethod
+    def _with_metadata(model: _Model, rec_ids, key: str):
+        # attach metadata for all recommended movies with a single reindex
+        titles = genres = [''] * len(rec_ids)
+        if model.movies_df is not None:
+            try:
+                meta = model.movies_df.reindex(rec_ids)
+                titles = meta['title'].fillna('').tolist()
+                genres = meta['genres'].fillna('').tolist()
+            except Exception:
+                log.warning('Failed to look up movie metadata for %s', key)
+        return [
+            {'movieId': mid, 'title': title, 'genres': genre,
+             'poster_url': f"https://via.placeholder.com/160x240?text={mid}"}
+            for mid, title, genre in zip(rec_ids, titles, genres)
+        ]
+
     def recommend(self, user_id: int, n: int = 10):
         RECOMMEND_COUNTER.inc()
-        # include model version in cache key so keys automatically invalidate when model changes
-        mv = self.model_version or self._compute_model_version()
-        key = f"rec:v{mv}:u{user_id}:n{n}"
+        # read the published model once; a concurrent retrain swaps in a new one without
+        # affecting this request
+        m = self._model
+        if m is None:
+            log.debug('No model loaded; returning empty')
+            return []
+        key = self._cache_key(m, user_id, n)
         if self.cache:
             cached = self.cache.get(key)
             if cached is not None:
@@ -156,42 +367,28 @@ class HybridRecommender:
                 return cached
 
         with RECOMMEND_LATENCY.time():
-            if user_id not in self.user_index:
+            uidx = m.user_id_to_idx.get(user_id)
+            if uidx is None:
                 log.debug('Unknown user_id %s; returning empty', user_id)
                 return []
-            uidx = self.user_index.index(user_id)
-            user_vec = self.user_item[uidx:uidx+1]
+            # only the items this user rated contribute to either projection, so project their
+            # rows alone instead of scanning every item with a mostly-zero dense vector
+            user_row = m.user_item[uidx]
+            rated, ratings = user_row.indices, user_row.data
 
-            # Collaborative scores: item similarity via users
-            item_sim = cosine_similarity(self.user_item.T, user_vec.T).ravel()
+            # Collaborative scores: item-item cosine similarity (via users) weighted by the user's ratings
+            # divided by the projection's norm so it is a cosine, on the same scale as content_sim
+            user_users = m.item_user_norm[rated].T @ ratings
+            item_sim = (m.item_user_norm @ user_users) / max(np.linalg.norm(user_users), 1e-9)
 
             # Content scores: similarity between user profile (weighted items) and item_profiles
             try:
-                user_profile = (user_vec.ravel() @ self.item_profiles)  # weighted sum
-                content_sim = cosine_similarity(self.item_profiles, user_profile.reshape(1, -1)).ravel()
+                user_profile = m.item_profiles[rated].T @ ratings  # weighted sum
+                content_sim = (m.item_profiles_norm @ user_profile) / max(np.linalg.norm(user_profile), 1e-9)
             except Exception:
-                content_sim = np.zeros(len(self.item_index))
+                content_sim = np.zeros(len(m.item_index), dtype=np.float32)
 
-            scores = normalize((item_sim.reshape(1, -1) + content_sim.reshape(1, -1))).ravel()
-            top_idx = np.argsort(-scores)[:n]
-            rec_ids = [int(self.item_index[i]) for i in top_idx]
-
-            # attach metadata for each recommended movie
-            recs = []
-            for mid in rec_ids:
-                try:
-                    if self.movies_df is not None and int(mid) in self.movies_df.index:
-                        row = self.movies_df.loc[int(mid)]
-                        title = str(row.get('title', ''))
-                        genres = str(row.get('genres', ''))
-                    else:
-                        title = ''
-                        genres = ''
-                except Exception:
-                    title = ''
-                    genres = ''
-                poster = f"https://via.placeholder.com/160x240?text={mid}"
-                recs.append({'movieId': mid, 'title': title, 'genres': genres, 'poster_url': poster})
+            recs = self._with_metadata(m, self._top_n(m, item_sim, content_sim, n), key)
 
             if self.cache:
                 try:
@@ -200,3 +397,53 @@ class HybridRecommender:
                     log.warning('Failed to set cache for %s', key)
             return recs
 
+    def recommend_batch(self, user_ids, n: int = 10):
+        """Recommend for several users at once; returns one list of recs per user id, in order.
+
+        Cache lookups and writes are a single MGET / pipeline, and all cache misses are scored
+        together with one sparse matrix product per score component.
+        """
+        from sklearn.preprocessing import normalize
+
+        user_ids = list(user_ids)
+        RECOMMEND_COUNTER.inc(len(user_ids))
+        m = self._model
+        if m is None:
+            log.debug('No model loaded; returning empty')
+            return [[] for _ in user_ids]
+        keys = [self._cache_key(m, u, n) for u in user_ids]
+        results = [None] * len(user_ids)
+        if self.cache:
+            try:
+                results = self.cache.get_many(keys)
+            except Exception:
+                log.warning('Failed to read cache for batch of %d users', len(user_ids))
+
+        with RECOMMEND_LATENCY.time():
+            pending = [i for i, r in enumerate(results) if r is None]
+            known = [i for i in pending if m.user_id_to_idx.get(user_ids[i]) is not None]
+            for i in pending:
+                results[i] = []
+            if not known:
+                return results
+
+            rows = m.user_item[[m.user_id_to_idx[user_ids[i]] for i in known]]
+            item_sim = normalize(rows @ m.item_user_norm, axis=1) @ m.item_user_norm.T
+            item_sim = item_sim.toarray()
+            try:
+                profiles = normalize(rows @ m.item_profiles, axis=1)
+                content_sim = (profiles @ m.item_profiles_norm.T).toarray()
+            except Exception:
+                content_sim = np.zeros_like(item_sim)
+
+            fresh = {}
+            for row, i in enumerate(known):
+                results[i] = self._with_metadata(m, self._top_n(m, item_sim[row], content_sim[row], n), keys[i])
+                fresh[keys[i]] = results[i]
+
+            if self.cache:
+                try:
+                    self.cache.set_many(fresh, ex=3600)
+                except Exception:
+                    log.warning('Failed to set cache for batch of %d users', len(fresh))
+            return results
@@ -1,16 +1,18 @@
 import os
+import asyncio
 import logging
 from fastapi import FastAPI, HTTPException, Request, Depends
 from fastapi.responses import JSONResponse
 from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 
 load_dotenv()
 
 from app.recommender import HybridRecommender
 from app.cache import RedisCache
-from app.auth import create_access_token, create_user, authenticate_user, get_current_user
+from app.auth import create_access_token, create_user, authenticate_user, get_current_user, init_db
 from app.logging_config import configure_logging
 from pydantic import BaseModel
 
@@ -37,28 +39,56 @@ FRONTEND_ORIGINS = [
     'http://localhost:5173'
 ]
 FRONTEND_ORIGINS = [o for o in FRONTEND_ORIGINS if o]
+# any local dev server (localhost / 127.0.0.1 on any port); Starlette compiles this once
+FRONTEND_ORIGIN_REGEX = os.getenv('FRONTEND_ORIGIN_REGEX', r'https?://(localhost|127\.0\.0\.1)(:\d+)?')
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=FRONTEND_ORIGINS or ['http://localhost:3000', 'http://localhost:5173'],
+    allow_origins=FRONTEND_ORIGINS,
+    allow_origin_regex=FRONTEND_ORIGIN_REGEX or None,
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    # let browsers cache preflight responses for a day
+    max_age=86400,
 )
 
 cache = RedisCache(REDIS_URL)
 recommender = HybridRecommender(model_path=MODEL_PATH, cache=cache)
 
 
+def _log_model_load_result(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        app.state.model_load_error = task.exception()
+        log.error('Model load failed', exc_info=task.exception())
+
+
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
     log.info('Starting application')
-    recommender.load_or_train()
+    init_db()
+    app.state.model_load_error = None
+    # load/train the model in the background so /login, /metrics etc. are served right away
+    app.state.model_load_task = asyncio.create_task(asyncio.to_thread(recommender.load_or_train))
+    app.state.model_load_task.add_done_callback(_log_model_load_result)
+
+
+@app.get("/health")
+def health():
+    if not recommender.ready:
+        status = "failed" if app.state.model_load_error is not None else "loading"
+        return JSONResponse(status_code=503, content={"status": status})
+    return {"status": "ok", "model_version": recommender.model_version}
 
 
 @app.get("/recommend/{user_id}")
-def recommend(user_id: int, n: int = 10, current_user: dict = Depends(get_current_user)):
+async def recommend(user_id: int, n: int = 10, current_user: dict = Depends(get_current_user)):
+    if not recommender.ready:
+        if app.state.model_load_error is not None:
+            raise HTTPException(status_code=503, detail='Model failed to load')
+        raise HTTPException(status_code=503, detail='Model is still loading')
     try:
-        results = recommender.recommend(user_id, n=n)
+        # scoring is NumPy/SciPy work that releases the GIL, so threadpool calls can overlap
+        results = await run_in_threadpool(recommender.recommend, user_id, n)
         return {"user_id": user_id, "recommendations": results}
     except Exception as e:
         log.exception('Recommendation failed')
@@ -66,14 +96,16 @@ def recommend(user_id: int, n: int = 10, current_user: dict = Depends(get_curren
 
 
 @app.post('/signup')
-def signup(payload: AuthModel):
-    user = create_user(payload.username, payload.password)
+async def signup(payload: AuthModel):
+    # hashing the password is CPU-bound; run it off the event loop
+    user = await run_in_threadpool(create_user, payload.username, payload.password)
     return {"id": user['id'], "username": user['username']}
 
 
 @app.post('/login')
-def login(payload: AuthModel):
-    user = authenticate_user(payload.username, payload.password)
+async def login(payload: AuthModel):
+    # bcrypt is CPU-bound; run it off the event loop
+    user = await run_in_threadpool(authenticate_user, payload.username, payload.password)
     if not user:
         raise HTTPException(status_code=401, detail='Invalid credentials')
     access_token = create_access_token({"sub": str(user['id'])})
@@ -85,6 +117,10 @@ def retrain(request: Request):
     token = request.headers.get("X-Retrain-Token")
     if token != os.getenv("RETRAIN_TOKEN"):
         raise HTTPException(status_code=403, detail="Invalid retrain token")
+    # don't train concurrently with the startup load/train; once it has finished (even if it
+    # failed) a retrain is allowed and recovers the recommender
+    if not app.state.model_load_task.done():
+        raise HTTPException(status_code=503, detail='Model is still loading')
     ok = recommender.retrain_and_reload()
     if not ok:
         raise HTTPException(status_code=500, detail='Retrain failed')